@@ -1,22 +1,12 @@
 import argparse
-import sys
-import errno
 import os
-import math
 from multiprocessing import Process, Queue
-import time
 import traceback
+from collections import defaultdict
 import logging
 log = logging.getLogger(__name__)
 
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-
-from intervaltree import IntervalTree, Interval
-import hicmatrix.HiCMatrix as hm
 
 from hicexplorer import utilities
 from hicexplorer._version import __version__
@@ -98,54 +88,80 @@ If the `--targetFileFolder` flag is not set in batch mode, it is assumed the `--
     return parser
 
 
-def filter_scores_target_list(pScoresDictionary, pTargetList=None, pTargetIntervalTree=None):
+def build_target_index(pTargetRegions):
+    # Per chromosome the target regions are sorted by (start, end) and stored as two int64 arrays: the start positions
+    # and the running maximum of the end positions. The first target overlapping [start, end) is then found with one
+    # binary search: the first index with a running maximum end > start, if that target starts before end.
+    regions_per_chromosome = {}
+    for chromosome, start, end in pTargetRegions:
+        regions_per_chromosome.setdefault(chromosome, []).append((int(start), int(end)))
+    target_index = {}
+    for chromosome, regions in regions_per_chromosome.items():
+        regions = np.array(sorted(regions), dtype=np.int64).reshape(-1, 2)
+        target_index[chromosome] = (regions[:, 0], np.maximum.accumulate(regions[:, 1]))
+    return target_index
+
+
+def filter_scores_target_list(pScoresDictionary, pTargetList=None, pTargetIndex=None):
 
     accepted_scores = {}
-    same_target_dict = {}
-    target_regions_intervaltree = None
+    same_target_dict = defaultdict(list)
+    target_index = None
     if pTargetList is not None:
         target_regions = utilities.readBed(pTargetList)
         if len(target_regions) == 0:
             return accepted_scores
 
-        hicmatrix = hm.hiCMatrix()
-        target_regions_intervaltree = hicmatrix.intervalListToIntervalTree(target_regions)[0]
-    elif pTargetIntervalTree is not None:
-        target_regions_intervaltree = pTargetIntervalTree
+        target_index = build_target_index(target_regions)
+    elif pTargetIndex is not None:
+        target_index = pTargetIndex
     else:
         log.error('No target list given.')
         raise Exception('No target list given.')
-    for key in pScoresDictionary:
-        # try:
-        chromosome = pScoresDictionary[key][0]
-        start = int(pScoresDictionary[key][1])
-        end = int(pScoresDictionary[key][2])
-        if chromosome in target_regions_intervaltree:
-            target_interval = target_regions_intervaltree[chromosome][start:end]
-        else:
-            continue
-        if target_interval:
-            target_interval = sorted(target_interval)[0]
-            if target_interval in same_target_dict:
-                same_target_dict[target_interval].append(key)
-            else:
-                same_target_dict[target_interval] = [key]
 
-    for target in same_target_dict:
+    # parse the genomic positions of all lines in one go instead of calling int() per line
+    keys = list(pScoresDictionary)
+    positions = np.array([pScoresDictionary[key][1:3] for key in keys], dtype=np.int64).reshape(-1, 2)
 
-        values = np.array([0.0, 0.0, 0.0])
-        same_target_dict[target] = sorted(same_target_dict[target])
+    # group the lines by chromosome and search the targets of all lines of a chromosome at once;
+    # chromosomes without any target are skipped as a whole
+    lines_per_chromosome = defaultdict(list)
+    for i, key in enumerate(keys):
+        lines_per_chromosome[pScoresDictionary[key][0]].append(i)
 
-        for key in same_target_dict[target]:
-            values += np.array(list(map(float, pScoresDictionary[key][-3:])))
-        new_data_line = pScoresDictionary[same_target_dict[target][0]]
-        new_data_line[2] = pScoresDictionary[same_target_dict[target][-1]][2]
-        new_data_line[-5] = pScoresDictionary[same_target_dict[target][-1]][-5]
-        new_data_line[-3] = values[0]
-        new_data_line[-2] = values[1]
-        new_data_line[-1] = values[2]
-
-        accepted_scores[same_target_dict[target][0]] = new_data_line
+    target_per_line = [None] * len(keys)
+    for chromosome, lines in lines_per_chromosome.items():
+        if chromosome not in target_index:
+            continue
+        target_starts, target_ends = target_index[chromosome]
+        lines = np.array(lines)
+        targets = np.searchsorted(target_ends, positions[lines, 0], side='right')
+        overlap = targets < len(target_starts)
+        overlap[overlap] = target_starts[targets[overlap]] < positions[lines[overlap], 1]
+        for line, target in zip(lines[overlap].tolist(), targets[overlap].tolist()):
+            target_per_line[line] = (chromosome, target)
+
+    for key, target in zip(keys, target_per_line):
+        if target is not None:
+            same_target_dict[target].append(key)
+
+    if len(same_target_dict) == 0:
+        return accepted_scores
+
+    # lay out the lines of all targets consecutively, parse the last three columns in one go
+    # and sum them per target on slices of this matrix
+    target_keys = [sorted(same_target_dict[target]) for target in same_target_dict]
+    group_ends = np.cumsum([len(target_lines) for target_lines in target_keys])
+    values = np.array([pScoresDictionary[key][-3:] for target_lines in target_keys for key in target_lines], dtype=np.float64)
+
+    for target_lines, group_end in zip(target_keys, group_ends):
+        target_values = values[group_end - len(target_lines):group_end].sum(axis=0)
+        new_data_line = pScoresDictionary[target_lines[0]]
+        new_data_line[2] = pScoresDictionary[target_lines[-1]][2]
+        new_data_line[-5] = pScoresDictionary[target_lines[-1]][-5]
+        new_data_line[-3:] = target_values
+
+        accepted_scores[target_lines[0]] = new_data_line
 
     return accepted_scores
 
@@ -162,19 +178,19 @@ def write(pOutFileName, pHeader, pNeighborhoods, pInteractionLines):
         file.write('\n')
 
         if pNeighborhoods is not None:
+            # chromosome, start, end, gene, sum of interactions, relative distance and the aggregated raw target value
+            line_format = '%s\t%s\t%s\t%s\t%s\t%s\t%10.5f\n'
+            new_lines = []
             for data in pNeighborhoods:
-                log.debug('pInteractionLines[data]: {}'.format(pInteractionLines[data]))
-                log.debug('pInteractionLines[data][:-6]: {}'.format(pInteractionLines[data][:6]))
-
-                new_line = '\t'.join(pInteractionLines[data][:6])
-                new_line += '\t' + format(pNeighborhoods[data][-1], '10.5f')
-                new_line += '\n'
-                file.write(new_line)
+                new_lines.append(line_format % (*pInteractionLines[data][:6], pNeighborhoods[data][-1]))
+            file.write(''.join(new_lines))
 
 
 def run_target_list_compilation(pInteractionFilesList, pTargetList, pArgs, pViewpointObj, pQueue=None, pOneTarget=False):
     outfile_names = []
-    target_regions_intervaltree = None
+    target_index = None
+    # one target file is shared by both samples of a pair and often by several pairs, parse and index it only once
+    target_index_cache = {}
     log.debug('size: interactionFileList: {} '.format(pInteractionFilesList))
     log.debug('size: pTargetList: {} '.format(pTargetList))
     log.debug('pOneTarget: {} '.format(pOneTarget))
@@ -182,8 +198,7 @@ def run_target_list_compilation(pInteractionFilesList, pTargetList, pArgs, pView
     try:
         if pArgs.batchMode and len(pTargetList) == 1 and pOneTarget == True:
             target_regions = utilities.readBed(pTargetList[0])
-            hicmatrix = hm.hiCMatrix()
-            target_regions_intervaltree = hicmatrix.intervalListToIntervalTree(target_regions)[0]
+            target_index = build_target_index(target_regions)
 
         for i, interactionFile in enumerate(pInteractionFilesList):
             for sample in interactionFile:
@@ -210,7 +225,13 @@ def run_target_list_compilation(pInteractionFilesList, pTargetList, pArgs, pView
                     target_file = pTargetList[i]
                     log.debug('205')
 
-                accepted_scores = filter_scores_target_list(interaction_file_data, pTargetList=target_file, pTargetIntervalTree=target_regions_intervaltree)
+                if target_file is not None:
+                    if target_file not in target_index_cache:
+                        target_regions = utilities.readBed(target_file)
+                        target_index_cache[target_file] = build_target_index(target_regions)
+                    target_index = target_index_cache[target_file]
+
+                accepted_scores = filter_scores_target_list(interaction_file_data, pTargetIndex=target_index)
 
                 if len(accepted_scores) == 0:
                     # do not call 'break' or 'continue'
@@ -244,10 +265,8 @@ def call_multi_core(pInteractionFilesList, pTargetFileList, pFunctionName, pArgs
     outfile_names = [None] * pArgs.threads
     interactionFilesPerThread = len(pInteractionFilesList) // pArgs.threads
 
-    all_data_collected = False
     queue = [None] * pArgs.threads
     process = [None] * pArgs.threads
-    thread_done = [False] * pArgs.threads
     one_target = True if len(pTargetFileList) == 1 else False
     fail_flag = False
     fail_message = ''
@@ -279,24 +298,17 @@ def call_multi_core(pInteractionFilesList, pTargetFileList, pFunctionName, pArgs
 
         process[i].start()
 
-    while not all_data_collected:
-        for i in range(pArgs.threads):
-            if queue[i] is not None and not queue[i].empty():
-                background_data_thread = queue[i].get()
-                if 'Fail:' in background_data_thread:
-                    fail_flag = True
-                    fail_message = background_data_thread[6:]
-                outfile_names[i] = background_data_thread
-                queue[i] = None
-                process[i].join()
-                process[i].terminate()
-                process[i] = None
-                thread_done[i] = True
-        all_data_collected = True
-        for thread in thread_done:
-            if not thread:
-                all_data_collected = False
-        time.sleep(1)
+    # collect the results in process order; get() blocks until the process has put its result
+    for i in range(pArgs.threads):
+        background_data_thread = queue[i].get()
+        if 'Fail:' in background_data_thread:
+            fail_flag = True
+            fail_message = background_data_thread[6:]
+        outfile_names[i] = background_data_thread
+        queue[i] = None
+        process[i].join()
+        process[i].terminate()
+        process[i] = None
     if fail_flag:
         log.error(fail_message)
         exit(1)
@@ -308,33 +320,20 @@ def main(args=None):
     args = parse_arguments().parse_args(args)
     viewpointObj = Viewpoint()
     outfile_names = []
-    if not os.path.exists(args.outputFolder):
-        try:
-            os.makedirs(args.outputFolder)
-        except OSError as exc:  # Guard against race condition
-            if exc.errno != errno.EEXIST:
-                raise
+    os.makedirs(args.outputFolder, exist_ok=True)
 
     interactionFileList = []
     targetFileList = []
 
     if args.batchMode:
         with open(args.interactionFile[0], 'r') as interactionFile:
-            file_ = True
-            while file_:
-                file_ = interactionFile.readline().strip()
-                file2_ = interactionFile.readline().strip()
-                if file_ != '' and file2_ != '':
-                    interactionFileList.append((file_, file2_))
+            file_names = [line.strip() for line in interactionFile if line.strip()]
+        interactionFileList = list(zip(file_names[0::2], file_names[1::2]))
 
         if len(args.targetFile) == 1 and args.targetFileFolder:
 
             with open(args.targetFile[0], 'r') as targetFile:
-                file_ = True
-                while file_:
-                    file_ = targetFile.readline().strip()
-                    if file_ != '':
-                        targetFileList.append(file_)
+                targetFileList = [line.strip() for line in targetFile if line.strip()]
         else:
             targetFileList = args.targetFile
         outfile_names = call_multi_core(interactionFileList, targetFileList, run_target_list_compilation, args, viewpointObj)
@@ -4,13 +4,14 @@ import os
 import errno
 import math
 from multiprocessing import Process, Queue
-import time
 import logging
 log = logging.getLogger(__name__)
 
 import numpy as np
 import matplotlib
 matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
@@ -164,40 +165,50 @@ In batch mode the list of file names and the folders containing the files need t
 
 def plot_images(pInteractionFileList, pHighlightDifferentialRegionsFileList, pBackgroundData, pArgs, pViewpointObj, pSignificantRegionsFileList, pQueue=None):
     try:
+        matplotlib.rcParams.update({'font.size': 9})
+        fig = None
+        colormap_p_value = None
+        if pArgs.pValue:
+            colormap_p_value = plt.get_cmap(pArgs.colorMapPvalue)
         for j, interactionFile in enumerate(pInteractionFileList):
             number_of_rows_plot = len(interactionFile)
-            matplotlib.rcParams.update({'font.size': 9})
-            fig = plt.figure(figsize=(9.4, 4.8))
-
-            z_score_heights = [0.07] * number_of_rows_plot
-            viewpoint_height_ratio = 0.95 - (0.07 * number_of_rows_plot)
-            if viewpoint_height_ratio < 0.4:
-                viewpoint_height_ratio = 0.4
-                _ratio = 0.6 / number_of_rows_plot
-                z_score_heights = [_ratio] * number_of_rows_plot
-
-            if pArgs.pValue:
-                gs = gridspec.GridSpec(1 + len(interactionFile), 2, height_ratios=[0.95 - (0.07 * number_of_rows_plot), *z_score_heights], width_ratios=[0.75, 0.25])
-                gs.update(hspace=0.5, wspace=0.05)
-                ax1 = plt.subplot(gs[0, 0])
-                ax1.margins(x=0)
-            else:
-                ax1 = plt.gca()
+            ax1 = None
             colors = pArgs.colorList
             background_plot = True
-            data_plot_label = None
+            data_plot_label = []
             gene = ''
-            for i, interactionFile_ in enumerate(interactionFile):
-                if pArgs.interactionFileFolder != '.':
-                    absolute_path_interactionFile_ = pArgs.interactionFileFolder + '/' + interactionFile_
-                else:
-                    absolute_path_interactionFile_ = interactionFile_
-
+            interactionFilePaths = [os.path.join(pArgs.interactionFileFolder, interactionFile_) for interactionFile_ in interactionFile]
+            if pArgs.differentialTestResult:
+                differentialFilePath = os.path.join(pArgs.differentialTestResultsFolder, pHighlightDifferentialRegionsFileList[j])
+            if pArgs.significantInteractions:
+                significantInteractionsFilePaths = [os.path.join(pArgs.significantInteractionFileFolder, significantFile) for significantFile in pSignificantRegionsFileList[j]]
+            for i, (interactionFile_, absolute_path_interactionFile_) in enumerate(zip(interactionFile, interactionFilePaths)):
                 header, data, background_data_plot, p_values, viewpoint_index_start, viewpoint_index_end = pViewpointObj.getDataForPlotting(absolute_path_interactionFile_, pArgs.range, pBackgroundData, pArgs.binResolution)
                 # log.debug('data {}'.format(data))
                 if len(data) <= 1 or len(p_values) <= 1:
                     log.warning('Only one data point in given range, no plot is created! Interaction file {} Range {}'.format(interactionFile_, pArgs.range))
                     continue
+                data = np.asarray(data, dtype=np.float32)
+                if ax1 is None:
+                    if fig is None:
+                        fig = Figure(figsize=(9.4, 4.8))
+                        FigureCanvasAgg(fig)
+                    fig.clear()
+
+                    z_score_heights = [0.07] * number_of_rows_plot
+                    viewpoint_height_ratio = 0.95 - (0.07 * number_of_rows_plot)
+                    if viewpoint_height_ratio < 0.4:
+                        viewpoint_height_ratio = 0.4
+                        _ratio = 0.6 / number_of_rows_plot
+                        z_score_heights = [_ratio] * number_of_rows_plot
+
+                    if pArgs.pValue:
+                        gs = gridspec.GridSpec(1 + len(interactionFile), 2, height_ratios=[0.95 - (0.07 * number_of_rows_plot), *z_score_heights], width_ratios=[0.75, 0.25], figure=fig)
+                        gs.update(hspace=0.5, wspace=0.05)
+                        ax1 = fig.add_subplot(gs[0, 0])
+                        ax1.margins(x=0)
+                    else:
+                        ax1 = fig.add_axes([0.125, 0.11, 0.775, 0.77])
                 matrix_name, viewpoint, upstream_range, downstream_range, gene, _ = header.strip().split('\t')
                 log.debug('Matrix_name {}'.format(matrix_name))
                 matrix_name = os.path.basename(matrix_name)
@@ -209,50 +220,35 @@ def plot_images(pInteractionFileList, pHighlightDifferentialRegionsFileList, pBa
                 significant_p_values = None
                 significant_regions = None
                 if pArgs.differentialTestResult:
-                    if pArgs.differentialTestResultsFolder != '.':
-                        differentialFilePath = pArgs.differentialTestResultsFolder + '/' + pHighlightDifferentialRegionsFileList[j]
-                    else:
-                        differentialFilePath = pHighlightDifferentialRegionsFileList[j]
-
                     highlight_differential_regions = pViewpointObj.readRejectedFile(differentialFilePath, viewpoint_index_start, viewpoint_index_end, pArgs.binResolution, pArgs.range, viewpoint)
                 if pArgs.significantInteractions:
-                    if pArgs.significantInteractionFileFolder != '.':
-                        significantInteractionsFilePath = pArgs.significantInteractionFileFolder + '/' + pSignificantRegionsFileList[j][i]
-                    else:
-                        significantInteractionsFilePath = pSignificantRegionsFileList[j][i]
-                    significant_regions, significant_p_values = pViewpointObj.readSignificantRegionsFile(significantInteractionsFilePath, viewpoint_index_start, viewpoint_index_end, pArgs.binResolution, pArgs.range, viewpoint)
+                    significant_regions, significant_p_values = pViewpointObj.readSignificantRegionsFile(significantInteractionsFilePaths[i], viewpoint_index_start, viewpoint_index_end, pArgs.binResolution, pArgs.range, viewpoint)
                 if not pArgs.plotSignificantInteractions:
                     significant_regions = None
-                if data_plot_label:
-                    data_plot_label += pViewpointObj.plotViewpoint(pAxis=ax1, pData=data, pColor=colors[i % len(colors)], pLabelName=gene + ': ' + matrix_name, pHighlightRegion=highlight_differential_regions, pHighlightSignificantRegion=significant_regions)
-                else:
-                    data_plot_label = pViewpointObj.plotViewpoint(pAxis=ax1, pData=data, pColor=colors[i % len(colors)], pLabelName=gene + ': ' + matrix_name, pHighlightRegion=highlight_differential_regions, pHighlightSignificantRegion=significant_regions)
+                data_plot_label += pViewpointObj.plotViewpoint(pAxis=ax1, pData=data, pColor=colors[i % len(colors)], pLabelName=gene + ': ' + matrix_name, pHighlightRegion=highlight_differential_regions, pHighlightSignificantRegion=significant_regions)
 
                 if background_plot:
                     # log.debug('background_data_plot {}'.format(len(background_data_plot)))
                     if background_data_plot is not None:
                         data_plot_label += pViewpointObj.plotBackgroundModel(pAxis=ax1, pBackgroundData=background_data_plot, pXFold=pArgs.xFold)
                     background_plot = False
+                p_values = np.fromiter(p_values, dtype=np.float32, count=len(p_values))
                 if pArgs.truncateZeroPvalues:
-                    p_values = np.array(p_values, dtype=np.float32)
-                    mask = p_values == 0.0
-                    p_values[mask] = 1.0
+                    p_values[p_values == 0.0] = 1.0
                 if pArgs.minPValue is not None or pArgs.maxPValue is not None:
-
-                    p_values = np.array(p_values, dtype=np.float32)
                     if significant_p_values:
                         for location in significant_p_values:
                             for x in range(location[0], location[1]):
                                 if x < len(p_values):
                                     p_values[x] = location[2]
-                    p_values.clip(pArgs.minPValue, pArgs.maxPValue, p_values)
+                    np.clip(p_values, pArgs.minPValue, pArgs.maxPValue, out=p_values)
 
                 if pArgs.pValue:
-                    pViewpointObj.plotPValue(pAxis=plt.subplot(gs[1 + i, 0]), pAxisLabel=plt.subplot(gs[1 + i, 1]), pPValueData=p_values,
-                                             pLabelText=gene + ': ' + matrix_name, pCmap=pArgs.colorMapPvalue,
+                    pViewpointObj.plotPValue(pAxis=fig.add_subplot(gs[1 + i, 0]), pAxisLabel=fig.add_subplot(gs[1 + i, 1]), pPValueData=p_values,
+                                             pLabelText=gene + ': ' + matrix_name, pCmap=colormap_p_value,
                                              pFigure=fig, pValueSignificanceLevels=pArgs.pValueSignificanceLevels)
 
-            if data_plot_label is not None:
+            if data_plot_label:
 
                 ticks = []
                 x_labels = []
@@ -299,27 +295,22 @@ def plot_images(pInteractionFileList, pHighlightDifferentialRegionsFileList, pBa
                 data_legend = [label.get_label() for label in data_plot_label]
                 ax1.legend(data_plot_label, data_legend, loc=0)
 
-                sample_prefix = ""
                 if pArgs.outFileName:
-                    if pArgs.outputFolder != '.':
-                        outFileName = pArgs.outputFolder + '/' + pArgs.outFileName
-                    else:
-                        outFileName = pArgs.outFileName
+                    outFileName = os.path.join(pArgs.outputFolder, pArgs.outFileName)
 
                 else:
-                    for interactionFile_ in interactionFile:
-                        sample_prefix += interactionFile_.split('/')[-1].split('_')[0] + '_'
-                    if sample_prefix.endswith('_'):
-                        sample_prefix = sample_prefix[:-1]
-                    region_prefix = '_'.join(interactionFile[0].split('/')[-1].split('_')[1:4])
+                    file_names = [interactionFile_.split('/')[-1] for interactionFile_ in interactionFile]
+                    sample_prefix = '_'.join(file_name.split('_', 1)[0] for file_name in file_names)
+                    region_prefix = '_'.join(file_names[0].split('_', 4)[1:4])
                     outFileName = gene + '_' + sample_prefix + '_' + region_prefix
-                    if pArgs.outputFolder != '.':
-                        outFileName = pArgs.outputFolder + '/' + outFileName
+                    outFileName = os.path.join(pArgs.outputFolder, outFileName)
 
                 if pArgs.outputFormat != outFileName.split('.')[-1]:
                     outFileName = outFileName + '.' + pArgs.outputFormat
-                plt.savefig(outFileName, dpi=pArgs.dpi)
-            plt.close(fig)
+                if pArgs.outputFormat == 'png':
+                    fig.savefig(outFileName, dpi=pArgs.dpi, pil_kwargs={'compress_level': 1})
+                else:
+                    fig.savefig(outFileName, dpi=pArgs.dpi)
     except Exception as exp:
         pQueue.put('Fail: ' + str(exp))
         return
@@ -351,6 +342,7 @@ def main(args=None):
                 exit(1)
     if args.backgroundModelFile:
         background_data = viewpointObj.readBackgroundDataFile(args.backgroundModelFile, args.range, args.range[1], pMean=True)
+        background_data = viewpointObj.backgroundDataForPlotting(background_data, args.range)
 
     interactionFileList = []
     highlightDifferentialRegionsFileList = []
@@ -358,15 +350,8 @@ def main(args=None):
 
     if args.batchMode:
         with open(args.interactionFile[0], 'r') as interactionFile:
-
-            file_ = True
-            while file_:
-                lines = []
-                for i in range(0, args.plotSampleNumber):
-                    file_ = interactionFile.readline().strip()
-                    if file_ != '':
-                        lines.append(file_)
-                interactionFileList.append(lines)
+            file_names = [line.strip() for line in interactionFile if line.strip()]
+        interactionFileList = [file_names[i:i + args.plotSampleNumber] for i in range(0, len(file_names), args.plotSampleNumber)]
         if args.differentialTestResult:
 
             if args.differentialTestResult and args.plotSampleNumber != 2:
@@ -374,31 +359,16 @@ def main(args=None):
                 args.differentialTestResult = None
             else:
                 with open(args.differentialTestResult[0], 'r') as differentialTestFile:
-
-                    file_ = True
-                    while file_:
-                        file_ = differentialTestFile.readline().strip()
-                        if file_ != '':
-                            highlightDifferentialRegionsFileList.append(file_)
+                    highlightDifferentialRegionsFileList = [line.strip() for line in differentialTestFile if line.strip()]
         if args.significantInteractions:
             with open(args.significantInteractions[0], 'r') as significantRegionsFile:
-
-                file_ = True
-                while file_:
-                    lines = []
-                    for i in range(0, args.plotSampleNumber):
-                        file_ = significantRegionsFile.readline().strip()
-                        if file_ != '':
-                            lines.append(file_)
-                    if len(lines) > 0:
-                        highlightSignificantRegionsFileList.append(lines)
+                file_names = [line.strip() for line in significantRegionsFile if line.strip()]
+            highlightSignificantRegionsFileList = [file_names[i:i + args.plotSampleNumber] for i in range(0, len(file_names), args.plotSampleNumber)]
         interactionFilesPerThread = len(interactionFileList) // args.threads
         highlightSignificantRegionsFileListThread = len(highlightSignificantRegionsFileList) // args.threads
 
-        all_data_collected = False
         queue = [None] * args.threads
         process = [None] * args.threads
-        thread_done = [False] * args.threads
         fail_flag = False
         fail_message = ''
 
@@ -426,23 +396,16 @@ def main(args=None):
 
             process[i].start()
 
-        while not all_data_collected:
-            for i in range(args.threads):
-                if queue[i] is not None and not queue[i].empty():
-                    return_content = queue[i].get()
-                    if 'Fail:' in return_content:
-                        fail_flag = True
-                        fail_message = return_content[6:]
-                    queue[i] = None
-                    process[i].join()
-                    process[i].terminate()
-                    process[i] = None
-                    thread_done[i] = True
-            all_data_collected = True
-            for thread in thread_done:
-                if not thread:
-                    all_data_collected = False
-            time.sleep(1)
+        # collect the results in process order; get() blocks until the process has put its result
+        for i in range(args.threads):
+            return_content = queue[i].get()
+            if 'Fail:' in return_content:
+                fail_flag = True
+                fail_message = return_content[6:]
+            queue[i] = None
+            process[i].join()
+            process[i].terminate()
+            process[i] = None
         if fail_flag:
             log.error(fail_message)
             exit(1)
@@ -1,18 +1,12 @@
 import argparse
-import sys
 import os
-import errno
-import math
 from multiprocessing import Process, Queue
-import time
 import logging
 log = logging.getLogger(__name__)
 
 import pybedtools
 import numpy as np
 
-import hicmatrix.HiCMatrix as hm
-from hicexplorer import utilities
 from hicexplorer._version import __version__
 from .lib import Viewpoint
 from hicexplorer.lib import cnb
@@ -226,11 +220,13 @@ def compute_new_p_values(pData, pBackgroundModel, pPValue, pMergedLinesDict, pPe
     if isinstance(pPValue, float):
         for key in pData:
             if key in pBackgroundModel:
+                # raw interactions are needed for the p-value and the peak threshold, parse them once
+                raw_interactions = float(pData[key][-1])
                 log.debug('Recompute p-values. Old: {}'.format(pData[key][-3]))
-                pData[key][-3] = 1 - cnb.cdf(float(pData[key][-1]), float(pBackgroundModel[key][0]), float(pBackgroundModel[key][1]))
+                pData[key][-3] = 1 - cnb.cdf(raw_interactions, float(pBackgroundModel[key][0]), float(pBackgroundModel[key][1]))
                 log.debug('new {}\n\n'.format(pData[key][-3]))
                 if pData[key][-3] <= pPValue:
-                    if float(pData[key][-1]) >= pPeakInteractionsThreshold:
+                    if raw_interactions >= pPeakInteractionsThreshold:
                         accepted[key] = pData[key]
                         target_content = pMergedLinesDict[key][0][:3]
                         target_content[2] = pMergedLinesDict[key][-1][2]
@@ -240,13 +236,14 @@ def compute_new_p_values(pData, pBackgroundModel, pPValue, pMergedLinesDict, pPe
     elif isinstance(pPValue, dict):
         for key in pData:
             if key in pBackgroundModel:
+                raw_interactions = float(pData[key][-1])
                 log.debug('Recompute p-values. Old: {}'.format(pData[key][-3]))
 
-                pData[key][-3] = 1 - cnb.cdf(float(pData[key][-1]), float(pBackgroundModel[key][0]), float(pBackgroundModel[key][1]))
+                pData[key][-3] = 1 - cnb.cdf(raw_interactions, float(pBackgroundModel[key][0]), float(pBackgroundModel[key][1]))
                 log.debug('new {}\n\n'.format(pData[key][-3]))
 
                 if pData[key][-3] <= pPValue[key]:
-                    if float(pData[key][-1]) >= pPeakInteractionsThreshold:
+                    if raw_interactions >= pPeakInteractionsThreshold:
                         accepted[key] = pData[key]
                         target_content = pMergedLinesDict[key][0][:3]
                         target_content[2] = pMergedLinesDict[key][-1][2]
@@ -260,10 +257,10 @@ def merge_neighbors_x_fold(pXfold, pData, pViewpointObj, pResolution):
     accepted = {}
     accepted_line = {}
     if isinstance(pXfold, float):
-        for key in pData[1]:
-
-            if pData[1][key][-1] < pXfold:
-                continue
+        keys = list(pData[1])
+        x_fold = np.fromiter((pData[1][key][-1] for key in keys), dtype=np.float64, count=len(keys))
+        for index in np.flatnonzero(~(x_fold < pXfold)):
+            key = keys[index]
             accepted[key] = pData[1][key]
             accepted_line[key] = pData[2][key]
     elif isinstance(pXfold, dict):
@@ -281,13 +278,13 @@ def merge_neighbors_loose_p_value(pLoosePValue, pData, pViewpointObj, pResolutio
     accepted = {}
     accepted_line = {}
     if isinstance(pLoosePValue, float):
-        for key in pData[1]:
-            if pTruncateZeroPvalues:
-                if pData[1][key][1] == 0 or pData[1][key][1] > pLoosePValue:
-                    continue
-            else:
-                if pData[1][key][1] > pLoosePValue:
-                    continue
+        keys = list(pData[1])
+        p_values = np.fromiter((pData[1][key][1] for key in keys), dtype=np.float64, count=len(keys))
+        mask = ~(p_values > pLoosePValue)
+        if pTruncateZeroPvalues:
+            mask &= p_values != 0
+        for index in np.flatnonzero(mask):
+            key = keys[index]
             accepted[key] = pData[1][key]
             accepted_line[key] = pData[2][key]
     elif isinstance(pLoosePValue, dict):
@@ -314,22 +311,21 @@ def write(pOutFileName, pHeader, pInteractionLines):
             '#Chromosome\tStart\tEnd\tGene\tSum of interactions\tRelative position\tRelative interactions\tp-value\tx-fold\tRaw target')
         file.write('\n')
 
+        # six text columns followed by relative interactions, p-value, x-fold and raw target
+        line_format = '%s\t%s\t%s\t%s\t%s\t%s\t%.20f\t%.20f\t%.20f\t%.20f\n'
+        new_lines = []
         for data in pInteractionLines:
-            new_line = '\t'.join(pInteractionLines[data][:6])
-            new_line += '\t' + '\t'.join(format(float(x), "0.20f")
-                                         for x in pInteractionLines[data][6:])
-            new_line += '\n'
-            file.write(new_line)
+            line = pInteractionLines[data]
+            new_lines.append(line_format % (*line[:6], float(line[6]), float(line[7]), float(line[8]), float(line[9])))
+        file.write(''.join(new_lines))
 
 
 def call_multi_core(pInteractionFilesList, pArgs, pViewpointObj, pBackground):
     outfile_names = [None] * pArgs.threads
     target_list_name = [None] * pArgs.threads
     interactionFilesPerThread = len(pInteractionFilesList) // pArgs.threads
-    all_data_collected = False
     queue = [None] * pArgs.threads
     process = [None] * pArgs.threads
-    thread_done = [False] * pArgs.threads
 
     fail_flag = False
     fail_message = ''
@@ -353,25 +349,18 @@ def call_multi_core(pInteractionFilesList, pArgs, pViewpointObj, pBackground):
 
         process[i].start()
 
-    while not all_data_collected:
-        for i in range(pArgs.threads):
-            if queue[i] is not None and not queue[i].empty():
-                background_data_thread = queue[i].get()
-                if 'Fail:' in background_data_thread:
-                    fail_flag = True
-                    fail_message = background_data_thread[6:]
-                else:
-                    outfile_names[i], target_list_name[i] = background_data_thread
-                queue[i] = None
-                process[i].join()
-                process[i].terminate()
-                process[i] = None
-                thread_done[i] = True
-        all_data_collected = True
-        for thread in thread_done:
-            if not thread:
-                all_data_collected = False
-        time.sleep(1)
+    # collect the results in process order; get() blocks until the process has put its result
+    for i in range(pArgs.threads):
+        background_data_thread = queue[i].get()
+        if 'Fail:' in background_data_thread:
+            fail_flag = True
+            fail_message = background_data_thread[6:]
+        else:
+            outfile_names[i], target_list_name[i] = background_data_thread
+        queue[i] = None
+        process[i].join()
+        process[i].terminate()
+        process[i] = None
     if fail_flag:
         log.error(fail_message)
         exit(1)
@@ -437,18 +426,8 @@ def main(args=None):
     # args.p_value_dict = None
     # args.p_loose_value_dict = None
     # args.x_fold_dict = None
-    if not os.path.exists(args.outputFolder):
-        try:
-            os.makedirs(args.outputFolder)
-        except OSError as exc:  # Guard against race condition
-            if exc.errno != errno.EEXIST:
-                raise
-    if not os.path.exists(args.targetFolder):
-        try:
-            os.makedirs(args.targetFolder)
-        except OSError as exc:  # Guard against race condition
-            if exc.errno != errno.EEXIST:
-                raise
+    os.makedirs(args.outputFolder, exist_ok=True)
+    os.makedirs(args.targetFolder, exist_ok=True)
 
     if args.pValue:
         try:
@@ -475,15 +454,8 @@ def main(args=None):
         args.backgroundModelFile, args.range, args.fixateRange)
     if args.batchMode:
         with open(args.interactionFile[0], 'r') as interactionFile:
-            file_ = True
-            while file_:
-                lines = []
-                for i in range(0, args.computeSampleNumber):
-                    file_ = interactionFile.readline().strip()
-                    if file_ != '':
-                        lines.append(file_)
-                if len(lines) > 0:
-                    interactionFileList.append(lines)
+            file_names = [line.strip() for line in interactionFile if line.strip()]
+        interactionFileList = [file_names[i:i + args.computeSampleNumber] for i in range(0, len(file_names), args.computeSampleNumber)]
         log.debug('interactionFileList {}'.format(interactionFileList))
         outfile_names, target_list_name = call_multi_core(
             interactionFileList, args, viewpointObj, background_model)
@@ -6,6 +6,7 @@ import copy
 
 import sys
 from mpl_toolkits.axes_grid1 import make_axes_locatable
+from matplotlib.colors import BoundaryNorm, ListedColormap
 from scipy.stats import nbinom
 from scipy.special import gammaln
 from scipy import special
@@ -172,6 +173,15 @@ class Viewpoint():
                 distance[i] = distance[min_key]
         return distance
 
+    def backgroundDataForPlotting(self, pBackgroundModel, pRange):
+        '''
+        Converts a background model read with pMean=True to the sorted relative positions within pRange
+        and their mean values, both as numpy arrays. Used by getDataForPlotting.
+        '''
+        background_keys = np.array(sorted(key for key in pBackgroundModel if key >= -pRange[0] and key <= pRange[1]), dtype=np.int64)
+        background_values = np.array([pBackgroundModel[key][0] for key in background_keys.tolist()], dtype=np.float64)
+        return background_keys, background_values
+
     def writeInteractionFile(self, pBedFile, pData, pHeader, pPValueData, pXfold, pDecimalPlaces=12):
         '''
         Writes an interaction file for one viewpoint and one sample as a tab delimited file with one interaction per line.
@@ -388,67 +398,24 @@ class Viewpoint():
                 if key >= -pRange[0] and key <= pRange[1]:
                     continue
                 interaction_data.pop(key, None)
-            if pBackgroundModel:
-                background_data_keys_sorted = sorted(pBackgroundModel)
-
-                for key in background_data_keys_sorted:
-                    if key >= -pRange[0] and key <= pRange[1]:
-                        continue
-                    pBackgroundModel.pop(key, None)
-                background_data_keys_sorted = sorted(pBackgroundModel)
-
-        if pBackgroundModel:
-            # viewpoint_index = background_data_keys_sorted.index(0)
-            viewpoint_index_start = background_data_keys_sorted.index(0)
-
-            data_background = []
-
-            for key in background_data_keys_sorted:
-                # log.debug('key {}'.format(key))
-                if key in interaction_data:
-                    if key == 0:
-                        chromosome, start, end = genomic_coordinates[key]
-                        # log.debug('peak width {}'.format(np.abs(int(start) - int(end))))
-                        # log.debug('pResolution {}'.format(pResolution))
 
-                        if np.abs(int(start) - int(end)) > pResolution:
-
-                            peak_width = np.abs(int(start) - int(end)) // pResolution
-                            viewpoint_index_end = peak_width
-                            i = 0
-                            while i < peak_width:
-                                data.append(interaction_data[key])
-                                i += 1
-                    else:
-                        data.append(interaction_data[key])
-
-                    if key in p_value_data:
-                        if key == 0:
-                            chromosome, start, end = genomic_coordinates[key]
-                            if np.abs(int(start) - int(end)) > pResolution:
-                                peak_width = np.abs(int(start) - int(end)) // pResolution
-                                i = 0
-                                while i < peak_width:
-                                    p_value.append(p_value_data[key])
-                                    i += 1
-                                # log.debug('peak width: {}'.format(peak_width))
-                        else:
-                            p_value.append(p_value_data[key])
-                    if key == 0:
-                        chromosome, start, end = genomic_coordinates[key]
-                        if np.abs(int(start) - int(end)) > pResolution:
-                            peak_width = np.abs(int(start) - int(end)) // pResolution
-                            i = 0
-                            while i < peak_width:
-                                data_background.append(pBackgroundModel[key][0])
-                                log.debug('pBackgroundModel[key][0] {}'.format(pBackgroundModel[key][0]))
-                                log.debug('peak_width {}'.format(peak_width))
-                                log.debug('data_background[-1] {}'.format(data_background[-1]))
-
-                                i += 1
-                            # log.debug('peak width: {}'.format(peak_width))
-                    else:
-                        data_background.append(pBackgroundModel[key][0])
+        if pBackgroundModel is not None:
+            background_keys, background_values = pBackgroundModel
+            viewpoint_index_start = int(np.flatnonzero(background_keys == 0)[0])
+
+            # bins per background position; the viewpoint is spread over its peak width
+            repeats = np.fromiter((key in interaction_data for key in background_keys.tolist()), dtype=np.int64, count=len(background_keys))
+            if repeats[viewpoint_index_start]:
+                chromosome, start, end = genomic_coordinates[0]
+                if np.abs(int(start) - int(end)) > pResolution:
+                    viewpoint_index_end = np.abs(int(start) - int(end)) // pResolution
+                    repeats[viewpoint_index_start] = viewpoint_index_end
+                else:
+                    repeats[viewpoint_index_start] = 0
+            plot_keys = np.repeat(background_keys, repeats).tolist()
+            data = [interaction_data[key] for key in plot_keys]
+            p_value = [p_value_data[key] for key in plot_keys if key in p_value_data]
+            data_background = np.repeat(background_values, repeats).tolist()
 
             if viewpoint_index_end is None:
                 viewpoint_index_end = viewpoint_index_start
@@ -497,7 +464,7 @@ class Viewpoint():
 
     def plotViewpoint(self, pAxis, pData, pColor, pLabelName, pHighlightRegion=None, pHighlightSignificantRegion=None):
         data_plot_label = pAxis.plot(
-            range(len(pData)), pData, '-' + pColor, alpha=0.9, label=pLabelName, linewidth=1)
+            np.arange(len(pData), dtype=np.int32), pData, '-' + pColor, alpha=0.9, label=pLabelName, linewidth=1)
         if pHighlightRegion:
             for region in pHighlightRegion:
                 pAxis.axvspan(region[0], region[1], color='red', alpha=0.3)
@@ -517,8 +484,6 @@ class Viewpoint():
 
     def plotPValue(self, pAxis, pAxisLabel, pPValueData, pLabelText, pCmap, pFigure, pValueSignificanceLevels):
 
-        _z_score = np.empty([2, len(pPValueData)])
-        _z_score[:, :] = pPValueData
         pAxis.xaxis.set_visible(False)
         pAxis.yaxis.set_visible(False)
         divider = make_axes_locatable(pAxisLabel)
@@ -526,7 +491,8 @@ class Viewpoint():
 
         if pPValueData is not None:
             # log.debug('pValueSignificanceLevels {}'.format(pValueSignificanceLevels))
-            img = pAxis.contourf(_z_score, cmap=pCmap)
+            _p_value = np.asarray(pPValueData).reshape(1, -1)
+            img = pAxis.imshow(_p_value, aspect='auto', cmap=pCmap, interpolation='nearest')
             colorbar = pFigure.colorbar(
                 img, cax=cax, ticks=[min(pPValueData), max(pPValueData)])
             colorbar.ax.set_ylabel('p-value', size=6)
@@ -535,7 +501,10 @@ class Viewpoint():
             pValueSignificanceLevels.insert(0, -1)
             pValueSignificanceLevels.append(1)
 
-            img = pAxis.contourf(_z_score, levels=pValueSignificanceLevels, colors=['#CC0000', '#FFD43B', '#306998', '#FFFFFF'])
+            _p_value = np.asarray(pPValueData).reshape(1, -1)
+            img = pAxis.imshow(_p_value, aspect='auto', interpolation='nearest',
+                               cmap=ListedColormap(['#CC0000', '#FFD43B', '#306998', '#FFFFFF']),
+                               norm=BoundaryNorm(pValueSignificanceLevels, 4))
             colorbar = pFigure.colorbar(img, cax=cax, ticks=[pValueSignificanceLevels[1], pValueSignificanceLevels[2], pValueSignificanceLevels[3]])
             colorbar.ax.tick_params(labelsize=6)
             colorbar.ax.set_ylabel('p-value', size=6)
@@ -741,55 +710,39 @@ class Viewpoint():
             log.debug('dict is None or empty')
             return None
         key_list = list(pScoresDictionary.keys())
+        line_list = list(pScoresDictionary.values())
 
-        merge_ids = []
-        non_merge = []
-        for i, (key_pre, key_suc) in enumerate(zip(key_list[:-1], key_list[1:])):
+        # parse the relative positions and the four value columns once instead of per neighbor pair
+        relative_positions = np.array([line[5] for line in line_list], dtype=np.int64)
+        values = np.array([line[-4:] for line in line_list], dtype=np.float64)
+        is_neighbor = np.absolute(np.diff(relative_positions)) <= pMergeThreshold
 
-            if np.absolute(int(pScoresDictionary[key_pre][5]) - int(pScoresDictionary[key_suc][5])) <= pMergeThreshold:
-                if len(merge_ids) > 0 and merge_ids[-1][-1] == key_pre:
-                    merge_ids[-1].append(key_suc)
-                else:
-                    merge_ids.append([key_pre, key_suc])
-            else:
-                if i == len(key_list) - 1:
-                    non_merge.append(key_suc)
-                if merge_ids is not None and len(merge_ids) > 0 and merge_ids[-1][-1] != key_pre:
-                    non_merge.append(key_pre)
-                elif merge_ids is not None and len(merge_ids) == 0:
-                    non_merge.append(key_pre)
+        # runs of neighbors are the stretches of consecutive True values in is_neighbor, each extended by its successor line.
+        # Lines which are not part of a run are kept as they are, except the last line which was never compared as predecessor.
+        run_edges = np.diff(np.concatenate(([0], is_neighbor.astype(np.int8), [0])))
+        run_starts = np.flatnonzero(run_edges == 1)
+        run_ends = np.flatnonzero(run_edges == -1) + 1
+        non_merge = ~is_neighbor
+        non_merge[1:] &= ~is_neighbor[:-1]
 
         scores_dict = {}
         merged_lines_dict = {}
-        for element in merge_ids:
-            lines = []
-            lines.append(pScoresDictionary[element[0]])
-            index_maximum_element = 0
-            base_element = pScoresDictionary[element[0]]
-            values = np.array(list(map(float, base_element[-4:])))
-            max_value = float(base_element[-1])
-            for i, key in enumerate(element[1:]):
-                base_element[-6] = pScoresDictionary[key][-6]
-                values += np.array(list(map(float, pScoresDictionary[key][-4:])))
-                lines.append(pScoresDictionary[key])
-                if max_value < float(pScoresDictionary[key][-1]):
-                    max_value = float(pScoresDictionary[key][-1])
-                    index_maximum_element = i + 1
-            base_element = pScoresDictionary[element[index_maximum_element]]
-            base_element[-4] = values[0]
-            base_element[-3] = values[1]
-            base_element[-2] = values[2]
-            base_element[-1] = values[3]
-
-            base_element[2] = pScoresDictionary[element[-1]][2]
-            base_element[1] = pScoresDictionary[element[0]][1]
-
-            scores_dict[element[index_maximum_element]] = base_element
-            merged_lines_dict[element[index_maximum_element]] = lines
-
-        for key in non_merge:
-            scores_dict[key] = pScoresDictionary[key]
-            merged_lines_dict[key] = [pScoresDictionary[key]]
+        for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+            index_maximum_element = run_start + int(np.argmax(values[run_start:run_end, -1]))
+
+            line_list[run_start][-6] = line_list[run_end - 1][-6]
+            base_element = line_list[index_maximum_element]
+            base_element[-4:] = values[run_start:run_end].sum(axis=0)
+
+            base_element[2] = line_list[run_end - 1][2]
+            base_element[1] = line_list[run_start][1]
+
+            scores_dict[key_list[index_maximum_element]] = base_element
+            merged_lines_dict[key_list[index_maximum_element]] = line_list[run_start:run_end]
+
+        for i in np.flatnonzero(non_merge).tolist():
+            scores_dict[key_list[i]] = line_list[i]
+            merged_lines_dict[key_list[i]] = [line_list[i]]
 
         return scores_dict, merged_lines_dict
 
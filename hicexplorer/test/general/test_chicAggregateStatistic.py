@@ -1,5 +1,6 @@
 from hicexplorer import chicAggregateStatistic
 from tempfile import NamedTemporaryFile, mkdtemp
+import filecmp
 import os
 import pytest
 import warnings
@@ -11,6 +12,8 @@ ROOT = os.path.join(os.path.dirname(os.path.dirname(
 
 
 def are_files_equal(file1, file2, delta=2, skip=0):
+    if filecmp.cmp(file1, file2, shallow=False):
+        return True
     equal = True
     if delta:
         mismatches = 0
@@ -212,3 +215,58 @@ def test_batch_mode_one_targetfile_threads():
 
     assert set(os.listdir(ROOT + "chicAggregateStatistic/batch_mode/")
                ) == set(os.listdir(output_folder))
+
+
+def interaction_lines(pRegions):
+    # minimal chicViewpoint lines keyed by their start; the raw column is one per line to count the merged lines
+    return {int(start): [chromosome, str(start), str(end), 'Eya1', '1.0', str(start), '0.1', '0.5', '1.0', '1.0']
+            for chromosome, start, end in pRegions}
+
+
+def write_target_file(pRegions):
+    target_file = NamedTemporaryFile(mode='w', suffix='.bed', delete=False)
+    for chromosome, start, end in pRegions:
+        target_file.write('{}\t{}\t{}\n'.format(chromosome, start, end))
+    target_file.close()
+    return target_file.name
+
+
+def test_filter_scores_target_list_overlapping_targets():
+    # overlapping and duplicated targets: each line is merged into the overlapping target with the smallest (start, end)
+    target_file = write_target_file([('chr1', 100, 300), ('chr1', 600, 700), ('chr1', 100, 300),
+                                     ('chr1', 200, 500), ('chr1', 50, 150),
+                                     ('chr3', 10000, 11000), ('chr3', 10100, 10150), ('chr3', 10200, 10250)])
+    scores = interaction_lines([('chr1', 60, 80), ('chr1', 120, 140), ('chr1', 140, 160), ('chr1', 160, 170),
+                                ('chr1', 200, 220), ('chr1', 400, 420), ('chr1', 550, 560), ('chr1', 650, 660),
+                                ('chr2', 125, 140), ('chr3', 10120, 10130), ('chr3', 10300, 10310)])
+
+    accepted_scores = chicAggregateStatistic.filter_scores_target_list(scores, pTargetList=target_file)
+
+    # target 50-150: 60, 120, 140; target 100-300: 160, 200; target 200-500: 400; target 600-700: 650
+    # chr3: the long target 10000-11000 contains the later ones, both lines belong to it
+    assert sorted(accepted_scores) == [60, 160, 400, 650, 10120]
+    assert accepted_scores[60][2] == '160'
+    assert accepted_scores[60][-1] == 3
+    assert accepted_scores[160][2] == '220'
+    assert accepted_scores[160][-1] == 2
+    assert accepted_scores[400][2] == '420'
+    assert accepted_scores[400][-1] == 1
+    assert accepted_scores[650][2] == '660'
+    assert accepted_scores[650][-1] == 1
+    assert accepted_scores[10120][2] == '10310'
+    assert accepted_scores[10120][-1] == 2
+    os.remove(target_file)
+
+
+def test_filter_scores_target_list_unsorted_targets():
+    # regions of a chromosome separated by another chromosome in the target file must all be used
+    target_file = write_target_file([('chr1', 100, 200), ('chr2', 100, 200), ('chr1', 400, 500)])
+    scores = interaction_lines([('chr1', 120, 130), ('chr1', 420, 430), ('chr2', 150, 160)])
+
+    accepted_scores = chicAggregateStatistic.filter_scores_target_list(scores, pTargetList=target_file)
+
+    assert sorted(accepted_scores) == [120, 150, 420]
+    assert accepted_scores[120][0] == 'chr1'
+    assert accepted_scores[150][0] == 'chr2'
+    assert accepted_scores[420][0] == 'chr1'
+    os.remove(target_file)
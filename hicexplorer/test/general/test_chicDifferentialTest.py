@@ -1,5 +1,6 @@
 from hicexplorer import chicDifferentialTest
 from tempfile import NamedTemporaryFile, mkdtemp
+import filecmp
 import os
 import pytest
 import warnings
@@ -11,6 +12,8 @@ ROOT = os.path.join(os.path.dirname(os.path.dirname(
 
 
 def are_files_equal(file1, file2, delta=2, skip=0):
+    if filecmp.cmp(file1, file2, shallow=False):
+        return True
     equal = True
     if delta:
         mismatches = 0